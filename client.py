@@ -1,9 +1,16 @@
-import threading
+import os
+import select
 import socket
+import struct
+import sys
+import threading
 from sty import fg, ef
 
 HOST = "127.0.0.1"
 PORT = 65432
+HEADER = struct.Struct("!I")
+SOCKET_BUFFER_SIZE = 64 * 1024
+CAN_POLL_STDIN = os.name != "nt" and sys.stdin.isatty()
 
 """
 try:
@@ -22,59 +29,135 @@ if not nickname.strip():
         f.write(nickname)
 """
 
+
+def tune_socket(sock):
+    """Disables Nagle's algorithm on a connected socket."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
 nickname = input("Enter nickname: ")
 
 client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# Set before connect() so that the window scale is negotiated accordingly.
+client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+client.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
 client.connect((HOST, PORT))
-stop_thread = False
+tune_socket(client)
+stop_event = threading.Event()
+
+
+class RecvBuffer:
+    """Represents the receive buffer of the connection. Messages are prefixed by their length as a 4-byte big-endian integer."""
+
+    __slots__ = ("buf", "view", "start", "end")
+
+    def __init__(self, size: int = 16384):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def fill(self, sock):
+        """Reads available data from the socket into the buffer, first moving any partial message to its start and growing the buffer if it is full."""
+        if self.start:
+            self.view[:self.end - self.start] = self.view[self.start:self.end]
+            self.end -= self.start
+            self.start = 0
+        if self.end == len(self.buf):
+            self.buf = self.buf + bytes(len(self.buf))
+            self.view = memoryview(self.buf)
+        n = sock.recv_into(self.view[self.end:], len(self.buf) - self.end)
+        if not n:
+            raise ConnectionError("connection closed.")
+        self.end += n
+
+    def pop(self):
+        """Removes and returns the next complete message, or `None` if there is none."""
+        start = self.start
+        if self.end - start < HEADER.size:
+            return None
+        size = HEADER.size + HEADER.unpack_from(self.buf, start)[0]
+        if start + size > self.end:
+            return None
+        self.start = start + size
+        return str(self.view[start + HEADER.size:start + size], "utf-8")
+
+
+recv_buffer = RecvBuffer()
+
+
+def recv_message() -> str:
+    """Reads a length-prefixed message from the server."""
+    while True:
+        message = recv_buffer.pop()
+        if message is not None:
+            return message
+        recv_buffer.fill(client)
+
+
+def send_message(message: str):
+    """Sends a length-prefixed message to the server."""
+    data = message.encode("utf-8")
+    client.sendall(HEADER.pack(len(data)) + data)
 
 
 def receive():
     """Main loop."""
-    global stop_thread
     while True:
         try:
-            message = client.recv(1024).decode("utf-8")
+            message = recv_message()
             if message == "/delete":
                 print(fg.red + ef.bold + "\nGroup deleted!" + ef.rs + fg.rs + "\n")
-                stop_thread = True
+                stop_event.set()
                 client.close()
                 break
             if message == "/kick":
                 print(fg.red + ef.bold + "\nYou were kicked!" + ef.rs + fg.rs + "\n")
-                stop_thread = True
+                stop_event.set()
                 client.close()
                 break
             if message == "/ban":
                 print(fg.red + ef.bold + "\nYou were banned!" + ef.rs + fg.rs + "\n")
-                stop_thread = True
+                stop_event.set()
                 client.close()
                 break
             if message == "/quit":
                 print(fg.red + ef.bold + "\nYou quit the group!" + ef.rs + fg.rs + "\n")
-                stop_thread = True
+                stop_event.set()
                 client.close()
                 break
             if message == "/nick":
-                client.send(nickname.encode("utf-8"))
+                send_message(nickname)
             elif message.endswith("\n"):
                 print(message, end="")
             else:
                 print(message)
         except Exception:
             # print("An error occurred!")
+            stop_event.set()
             client.close()
             break
 
 
+def wait_for_input() -> bool:
+    """Waits until a line can be read or the client is stopped. Returns `False` once stopped."""
+    if not CAN_POLL_STDIN:
+        return not stop_event.is_set()
+    while not stop_event.is_set():
+        readable, _, _ = select.select([sys.stdin], [], [], 0.1)
+        if readable:
+            return True
+    return False
+
+
 def write():
     """Writes message author and content."""
-    while not stop_thread:
+    while wait_for_input():
         try:
             input_msg = input().strip()
             if not input_msg:
                 continue
-            client.send(input_msg.encode("utf-8"))
+            send_message(input_msg)
         except:
             client.close()
             break
@@ -1,7 +1,72 @@
-import threading
+import collections
+import itertools
+import re
+import selectors
 import socket
+import struct
 from sty import fg, ef
-from uuid import uuid4
+
+
+_ID_COUNTER = itertools.count(1)
+_HEADER = struct.Struct("!I")
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+_MAX_CHUNKS = 64
+_SOCKET_BUFFER_SIZE = 64 * 1024
+_MAX_QUEUED = 16 * _SOCKET_BUFFER_SIZE
+
+
+# ============================== MESSAGES ============================== #
+_FG_RED, _FG_BLUE, _FG_GREEN, _FG_YELLOW, _FG_RS = fg.red, fg.blue, fg.green, fg.yellow, fg.rs
+_EF_BOLD, _EF_RS = ef.bold, ef.rs
+
+_BOLD     = _EF_BOLD.encode("utf-8")
+_BOLD_RS  = _EF_RS.encode("utf-8")
+_RED_B    = (_FG_RED + _EF_BOLD).encode("utf-8")
+_BLUE_B   = (_FG_BLUE + _EF_BOLD).encode("utf-8")
+_GREEN_B  = (_FG_GREEN + _EF_BOLD).encode("utf-8")
+_YELLOW_B = (_FG_YELLOW + _EF_BOLD).encode("utf-8")
+_RS       = (_EF_RS + _FG_RS).encode("utf-8")
+
+_INFO_HEADER = b"===============\n"
+_INFO_FOOTER = b"===============\n\n"
+_NICK = b"/nick"
+_QUIT = b"/quit"
+_DELETE = b"/delete"
+_KICK = b"/kick"
+_BAN = b"/ban"
+
+_OWNER_MARK     = ("  👑  " + _EF_BOLD).encode("utf-8")
+_MODERATOR_MARK = ("  ⭐️  " + _EF_BOLD).encode("utf-8")
+_MEMBER_MARK    = ("      " + _EF_BOLD).encode("utf-8")
+_INFO_LINE_END  = (_EF_RS + "\n").encode("utf-8")
+
+_OWNER_CANNOT_QUIT = (_FG_RED + "You cannot quit the group as you are the owner! Please transfer ownership before quitting." + _FG_RS).encode("utf-8")
+_PERM_DENIED = (_FG_RED + "Permission denied!" + _FG_RS).encode("utf-8")
+_EMPTY_NICKNAME = (_FG_RED + "Nickname cannot be empty!" + _FG_RS).encode("utf-8")
+_NUMBER_REQUIRED = (_FG_RED + "Number must be provided!" + _FG_RS).encode("utf-8")
+_NICKNAME_TAKEN = (_FG_RED + "Nickname is already taken by someone else!" + _FG_RS).encode("utf-8")
+_MEMBER_NOT_FOUND = (_FG_RED + "Member not found!" + _FG_RS).encode("utf-8")
+_CANNOT_KICK_SELF = (_FG_RED + "You cannot kick yourself! Please use /quit to quit the group." + _FG_RS).encode("utf-8")
+_CANNOT_KICK_OWNER = (_FG_RED + "Cannot kick user as they own the group!" + _FG_RS).encode("utf-8")
+_CANNOT_KICK_HIGHER = (_FG_RED + "Cannot kick user as they have permissions you do not have!" + _FG_RS).encode("utf-8")
+_CANNOT_BAN_SELF = (_FG_RED + "You cannot ban yourself!" + _FG_RS).encode("utf-8")
+_CANNOT_BAN_OWNER = (_FG_RED + "Cannot ban user as they own the group!" + _FG_RS).encode("utf-8")
+_CANNOT_BAN_HIGHER = (_FG_RED + "Cannot ban user as they have permissions you do not have!" + _FG_RS).encode("utf-8")
+_NO_NUMBER = (_FG_RED + "No number specified!" + _FG_RS).encode("utf-8")
+_UNKNOWN_PERMISSION_VALUE = (_FG_RED + "Permission value not recognised!" + _FG_RS).encode("utf-8")
+_CANNOT_GRANT_PERMISSIONS = (_FG_RED + "Cannot change permissions you do not have!" + _FG_RS).encode("utf-8")
+_USER_NOT_FOUND = (_FG_RED + "User not found!" + _FG_RS).encode("utf-8")
+_CANNOT_SETPERMS_SELF = (_FG_RED + "You cannot change yourself permissions!" + _FG_RS).encode("utf-8")
+_CANNOT_SETPERMS_OWNER = (_FG_RED + "Owner cannot be changed permissions!" + _FG_RS).encode("utf-8")
+_CANNOT_SETPERMS_HIGHER = (_FG_RED + "Cannot set these permissions for member as they have permissions you do not have!" + _FG_RS).encode("utf-8")
+_CANNOT_TRANSFER_SELF = (_FG_RED + "Cannot transfer ownership to yourself!" + _FG_RS).encode("utf-8")
+_UNKNOWN_COMMAND = (_FG_RED + "Unknown command!" + _FG_RS).encode("utf-8")
+_CANNOT_SEND = (_FG_RED + "No permission to send messages!" + _FG_RS).encode("utf-8")
+_EMPTY_NICKNAME_RETRY = (_FG_RED + "Nickname cannot be empty! Please retry!" + _FG_RS).encode("utf-8")
+_NICKNAME_CHOSEN = (_FG_RED + "Nickname already chosen! Please choose a different nickname!" + _FG_RS).encode("utf-8")
+_BANNED = (_FG_RED + _EF_BOLD + "You have been banned from this group and cannot rejoin it!" + _EF_RS + _FG_RS).encode("utf-8")
+_NOW_OWNER = (_FG_BLUE + _EF_BOLD + "You are now the group owner!" + _EF_RS + _FG_RS).encode("utf-8")
+_CONNECTED = (_FG_GREEN + _EF_BOLD + "Connected to the server!" + _EF_RS + _FG_RS).encode("utf-8")
 
 
 # ============================== ERRORS ============================== #
@@ -32,23 +97,28 @@ class PermissionValues:
         raise NotImplementedError("class cannot be initialised.") from None
 
 
-class Permissions:
-    """Represents permissions."""
+def is_subset(value: int, other: int) -> bool:
+    """Returns whether every permission set in `value` is also set in `other`."""
+    return (value & other) == value
+
+
+class Permissions(int):
+    """Represents permissions, as an immutable integer of `PermissionValues` flags."""
 
-    __slots__ = ("_value",)
+    __slots__ = ()
 
-    def __init__(self, value: int = 0):
+    def __new__(cls, value: int = 0):
         if not isinstance(value, int):
             raise TypeError("value must be int.") from None
         if value < 0:
             raise ValueError("value must be non-negative.") from None
         if value > PermissionValues.ALL:
             raise ValueError("value must be less than or equal to {0}.".format(PermissionValues.ALL)) from None
-        self._value = value
+        return super().__new__(cls, value)
     
     @property
     def value(self) -> int:
-        return self._value
+        return int(self)
     
     @classmethod
     def none(cls):
@@ -68,79 +138,62 @@ class Permissions:
     
     @property
     def read_messages(self) -> bool:
-        return bool(self._value >> 0 & 1)
+        return bool(self & PermissionValues.READ_MESSAGES)
     
     @property
     def send_messages(self) -> bool:
-        return bool(self._value >> 1 & 1)
+        return bool(self & PermissionValues.SEND_MESSAGES)
     
     @property
     def kick_members(self) -> bool:
-        return bool(self._value >> 2 & 1)
+        return bool(self & PermissionValues.KICK_MEMBERS)
     
     @property
     def ban_members(self) -> bool:
-        return bool(self._value >> 3 & 1)
+        return bool(self & PermissionValues.BAN_MEMBERS)
     
     @property
     def change_nickname(self) -> bool:
-        return bool(self._value >> 4 & 1)
+        return bool(self & PermissionValues.CHANGE_NICKNAME)
     
     @property
     def manage_nicknames(self) -> bool:
-        return bool(self._value >> 5 & 1)
+        return bool(self & PermissionValues.MANAGE_NICKNAMES)
     
     @property
     def change_settings(self) -> bool:
-        return bool(self._value >> 6 & 1)
+        return bool(self & PermissionValues.CHANGE_SETTINGS)
     
     @property
     def update_permissions(self) -> bool:
-        return bool(self._value >> 7 & 1)
+        return bool(self & PermissionValues.UPDATE_PERMISSIONS)
     
     @property
     def all_permissions(self) -> bool:
-        return self._value == PermissionValues.ALL
-    
-    def update(self, permission_value: int):
-        if not isinstance(permission_value, int):
-            raise TypeError("value must be int.") from None
-        if permission_value < 0:
-            raise ValueError("value must be non-negative.") from None
-        if permission_value > PermissionValues.ALL:
-            raise ValueError("value must be less than or equal to {0}.".format(PermissionValues.ALL)) from None
-        self._value = permission_value
-
-    def __bool__(self):
-        return bool(self._value)
-    
-    def __eq__(self, other):
-        if not isinstance(other, Permissions):
-            return False
-        return self._value == other._value
+        return self == PermissionValues.ALL
     
     def __le__(self, other):
         if not isinstance(other, Permissions):
             raise TypeError("cannot compare Permissions with {0}".format(other.__class__.__name__))
-        return (self._value & other._value) == self._value
+        return is_subset(self, other)
     
     def __ge__(self, other):
         if not isinstance(other, Permissions):
             raise TypeError("cannot compare Permissions with {0}".format(other.__class__.__name__))
-        return (self._value | other._value) == self._value
+        return is_subset(other, self)
 
     def __lt__(self, other):
-        return self.__le__(other) and self._value != other._value
+        return self.__le__(other) and int(self) != int(other)
     
     def __gt__(self, other):
-        return self.__ge__(other) and self._value != other._value
+        return self.__ge__(other) and int(self) != int(other)
 
 
 # ============================== GROUP ============================== #
 class Group:
     """Represents a group."""
 
-    __slots__ = ("_name", "_owner", "_clients", "_bans", "_default_perms", "_is_public", "_id")
+    __slots__ = ("_name", "_owner", "_clients", "_by_socket", "_by_nick", "_readers", "_bans", "_default_perms", "_is_public", "_id")
 
     def __init__(self, name: str, owner):
         if not isinstance(name, str):
@@ -154,10 +207,13 @@ class Group:
         self._name = name
         self._owner = _owner
         self._clients = [_owner]
+        self._by_socket = {_owner._socket: _owner}
+        self._by_nick = {_owner._nickname: _owner}
+        self._readers = [_owner]
         self._bans = set()
         self._default_perms = Permissions.default()
         self._is_public = True
-        self._id = uuid4().int
+        self._id = next(_ID_COUNTER)
     
     @property
     def name(self) -> str:
@@ -187,12 +243,13 @@ class Group:
     def id(self) -> int:
         return self._id
     
-    def get_index_of(self, socket) -> int:
-        """Returns index of client."""
-        for (index, cl) in enumerate(self._clients):
-            if cl._socket == socket:
-                return index
-        return None
+    def iter_clients(self):
+        """Returns an iterator over the clients, without copying them."""
+        return iter(self._clients)
+    
+    def get_client(self, socket):
+        """Returns the client using the socket, or `None` if not found."""
+        return self._by_socket.get(socket)
     
     def add(self, user):
         """Adds a user to the group. Ignored if user is already in the group."""
@@ -200,24 +257,25 @@ class Group:
             raise TypeError("user must be of type User.") from None
         if isinstance(user, Client):
             return user
-        for member in self._clients:
-            if member == user:
-                return member
+        member = self._by_socket.get(user.socket)
+        if member is not None:
+            return member
         if user.id in self._bans:
             raise Forbidden("member has been banned, and cannot be added!") from None
 
         member = Client(user.name, user.socket, self, self._default_perms)
         self._clients.append(member)
+        self._by_socket[member._socket] = member
+        self._by_nick[member._nickname] = member
+        if member._permissions & PermissionValues.READ_MESSAGES:
+            self._readers.append(member)
         return member
     
-    def search_member(self, string: str) -> tuple:
-        """Searchs and return a member, or `(-1, None)` if not found."""
+    def search_member(self, string: str):
+        """Searchs and return a member by nickname, or `None` if not found."""
         if not isinstance(string, str):
             raise TypeError("string must be of type string") from None
-        for (index, member) in enumerate(self._clients):
-            if member.nickname == string:
-                return (index, member)
-        return (-1, None)
+        return self._by_nick.get(string)
     
     def change_name(self, new_name: str):
         """Changes the name of the group."""
@@ -231,9 +289,9 @@ class Group:
     
     def change_default_permissions(self, new_value: int):
         """Changes the default member permissions of the group."""
-        if new_value == self._default_perms.value:
+        if new_value == self._default_perms:
             return
-        self._default_perms.update(new_value)
+        self._default_perms = Permissions(new_value)
     
     def make_public(self):
         """Marks the group as public."""
@@ -251,7 +309,7 @@ class Group:
             raise TypeError("new owner must be of type Client.") from None
         if self._owner == new_owner:
             return
-        new_owner._permissions = Permissions.all()
+        new_owner._set_permissions(Permissions.all())
         self._owner = new_owner
     
     def delete(self):
@@ -261,9 +319,12 @@ class Group:
         self._name = None
         self._default_perms = None
         self._owner = None
-        for member in self._clients:
+        for member in tuple(self._clients):
             member._kill()
         self._clients.clear()
+        self._by_socket.clear()
+        self._by_nick.clear()
+        self._readers.clear()
         self._bans.clear()
     
     def __bool__(self):
@@ -291,7 +352,7 @@ class User:
             raise ValueError("name cannot be empty.") from None
         self._socket = socket
         self._name = name
-        self._id = uuid4().int
+        self._id = next(_ID_COUNTER)
     
     @property
     def socket(self):
@@ -358,11 +419,11 @@ class Client(User):
     
     def set_permissions(self, new_value: int):
         """Sets new permissions for the member."""
-        if new_value == self._permissions.value:
+        if new_value == self._permissions:
             return
         if self.is_owner:
             raise Forbidden("owner cannot have permissions changed.") from None
-        self._permissions.update(new_value)
+        self._set_permissions(Permissions(new_value))
     
     def reset_permissions(self):
         """Resets member permissions to default group permissions."""
@@ -370,7 +431,7 @@ class Client(User):
             return
         if self.is_owner:
             raise Forbidden("owner cannot have permissions reset.") from None
-        self._permissions = self._group.default_perms
+        self._set_permissions(self._group.default_perms)
     
     def set_nickname(self, value: str):
         """Sets nickname."""
@@ -380,15 +441,22 @@ class Client(User):
             raise ValueError("value cannot be empty.")
         if value == self._nickname:
             return
-        for user in self._group.clients:
-            if user._nickname == value:
-                raise Forbidden("nickname already registered.")
+        by_nick = self._group._by_nick
+        if value in by_nick:
+            raise Forbidden("nickname already registered.")
+        del by_nick[self._nickname]
+        by_nick[value] = self
         self._nickname = value
     
     def reset_nickname(self):
         """Resets nickname."""
         if self._nickname == self.name:
             return
+        by_nick = self._group._by_nick
+        if self.name in by_nick:
+            raise Forbidden("nickname already registered.")
+        del by_nick[self._nickname]
+        by_nick[self.name] = self
         self._nickname = self.name
     
     def kick(self):
@@ -403,15 +471,28 @@ class Client(User):
         self.kick()
         group._bans.add(self._id)
     
-    def send(self, message):
-        """Sends a message."""
-        if not message.decode("utf-8").strip():
-            return
-        self._socket.send(message)
+    def send(self, *chunks: bytes):
+        """Sends a message made of one or more chunks."""
+        send_message(self._socket, *chunks)
+    
+    def _set_permissions(self, permissions: Permissions):
+        """Sets permissions, keeping the group readers up to date."""
+        readers = self._group._readers
+        if permissions & PermissionValues.READ_MESSAGES:
+            if self not in readers:
+                readers.append(self)
+        elif self in readers:
+            readers.remove(self)
+        self._permissions = permissions
     
     def _kill(self):
         """Kills client object."""
-        self._group._clients.remove(self)
+        group = self._group
+        group._clients.remove(self)
+        del group._by_socket[self._socket]
+        del group._by_nick[self._nickname]
+        if self in group._readers:
+            group._readers.remove(self)
         self._group = None
         self._permissions = None
         self._nickname = None
@@ -419,290 +500,444 @@ class Client(User):
         #self.socket = None
 
 
+# ============================== BUFFERS ============================== #
+class ConnBuffer:
+    """Represents the receive buffer and outgoing queue of a connection. Messages are prefixed by their length as a 4-byte big-endian integer."""
+
+    __slots__ = ("buf", "view", "start", "end", "outq", "queued")
+
+    def __init__(self, size: int = 16384):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.outq = collections.deque()
+        self.queued = 0
+
+    def fill(self, socket) -> int:
+        """Reads available data from the socket into the buffer, first moving any partial message to its start. Returns `0` if the connection was closed."""
+        if self.start:
+            self.view[:self.end - self.start] = self.view[self.start:self.end]
+            self.end -= self.start
+            self.start = 0
+        if self.end == len(self.buf):
+            raise OperationFailed("message is too long.") from None
+        n = socket.recv_into(self.view[self.end:], len(self.buf) - self.end)
+        self.end += n
+        return n
+
+    def pop(self):
+        """Removes and returns the next complete message, or `None` if there is none."""
+        start = self.start
+        if self.end - start < _HEADER.size:
+            return None
+        size = _HEADER.size + _HEADER.unpack_from(self.buf, start)[0]
+        if size > len(self.buf):
+            raise OperationFailed("message is too long.") from None
+        if start + size > self.end:
+            return None
+        message = bytes(self.view[start + _HEADER.size:start + size])
+        self.start = start + size
+        return message
+
+    def flush(self, socket):
+        """Writes as much of the outgoing queue as the socket accepts, gathering chunks in `sendmsg` calls when available."""
+        outq = self.outq
+        while outq:
+            chunks = list(itertools.islice(outq, _MAX_CHUNKS)) if _HAS_SENDMSG else [outq[0]]
+            sent = socket.sendmsg(chunks) if _HAS_SENDMSG else socket.send(chunks[0])
+            self.queued -= sent
+            complete = sent == sum(map(len, chunks))
+            while outq and sent >= len(outq[0]):
+                sent -= len(outq.popleft())
+            if sent:
+                outq[0] = memoryview(outq[0])[sent:]
+            if not complete:
+                return
+
+
+def get_key(socket):
+    """Returns the selector key of a connection, or `None` if it is closed or no longer registered."""
+    try:
+        return selector.get_key(socket)
+    except (KeyError, ValueError):
+        return None
+
+
+def send_message(socket, *chunks: bytes):
+    """Queues a length-prefixed message made of one or more chunks. Ignored if the connection is closed; marks it as overflowed once its queue would exceed `_MAX_QUEUED`."""
+    key = get_key(socket)
+    if key is None or socket in overflowed:
+        return
+    buffer: ConnBuffer = key.data
+    size = sum(map(len, chunks))
+    if buffer.queued + _HEADER.size + size > _MAX_QUEUED:
+        overflowed.add(socket)
+        return
+    if not buffer.outq:
+        selector.modify(socket, selectors.EVENT_READ | selectors.EVENT_WRITE, buffer)
+    buffer.outq.append(_HEADER.pack(size))
+    buffer.outq.extend(chunks)
+    buffer.queued += _HEADER.size + size
+
+
 # ============================== SERVER ============================== #
 host = "127.0.0.1"
 port = 65432
 
 server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# Set before listen() so that accepted sockets inherit them and the window scale is negotiated accordingly.
+server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, _SOCKET_BUFFER_SIZE)
+server.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, _SOCKET_BUFFER_SIZE)
 server.bind((host, port))
 server.listen()
 
 
+selector = selectors.DefaultSelector()
 group: Group = None
+pending = set()
+overflowed = set()
 
 
-def broadcast(message, exc=None):
-    """Brodcasts a message."""
-    for client in group.clients:
-        if client.permissions.read_messages and (exc is None or exc != client):
-            client.send(message)
+def broadcast(*chunks: bytes, exc=None):
+    """Brodcasts a message made of one or more chunks."""
+    for client in group._readers:
+        if client is not exc:
+            client.send(*chunks)
 
 
-def handle(socket):
-    global group
-    """Handles a client object."""
-    while True:
-        if group is None:
-            break
-        index = group.get_index_of(socket)
-        if index is None:
-            break
-        client: Client = group.clients[index]
-        try:
-            message = socket.recv(1024)
-            decoded = message.decode("utf-8").strip()
-            if not decoded:
-                continue
-            lowered = decoded.lower()
+def cmd_id(client: Client, rest: str):
+    """Sends the client its id."""
+    client.send(_BOLD, "Your id is {0}.".format(client.id).encode("utf-8"), _BOLD_RS)
 
-            if lowered == "/id" or lowered.startswith("/id "):
-                client.send((ef.bold + "Your id is {0}.".format(client.id) + ef.rs).encode("utf-8"))
-                continue
 
-            if lowered == "/info" or lowered.startswith("/info "):
-                client.send("===============\n".encode("utf-8"))
-                for cl_member in group.clients:
-                    if cl_member.is_owner:
-                        prefix = "  👑  "
-                    elif group.default_perms < cl_member.permissions:
-                        prefix = "  ⭐️  "
-                    else:
-                        prefix = "      "
-                    client.send((prefix + ef.bold + cl_member.nickname + ef.rs + "\n").encode("utf-8"))
-                client.send("===============\n\n".encode("utf-8"))
-                continue
-            
-            if lowered == "/quit" or lowered.startswith("/quit "):
-                if client.is_owner:
-                    client.send((fg.red + "You cannot quit the group as you are the owner! Please transfer ownership before quitting." + fg.rs).encode("utf-8"))
-                    continue
-                nickname = client.nickname
-                client.send("/quit".encode("utf-8"))
-                client._kill()
-                broadcast((fg.red + ef.bold + "{0} left the chat!".format(nickname) + ef.rs + fg.rs).encode("utf-8"))
-                break
+def cmd_info(client: Client, rest: str):
+    """Sends the client the list of group members."""
+    client.send(_INFO_HEADER)
+    default = group._default_perms
+    for cl_member in group.iter_clients():
+        perms = cl_member._permissions
+        if cl_member.is_owner:
+            prefix = _OWNER_MARK
+        elif perms != default and is_subset(default, perms):
+            prefix = _MODERATOR_MARK
+        else:
+            prefix = _MEMBER_MARK
+        client.send(prefix, cl_member.nickname.encode("utf-8"), _INFO_LINE_END)
+    client.send(_INFO_FOOTER)
 
-            if lowered == "/delete" or lowered.startswith("/delete "):
-                if not client.is_owner:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                broadcast("/delete".encode("utf-8"))
-                group.delete()
-                group = None
-                break
 
-            if lowered == "/nick":
-                if not client.permissions.change_nickname:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                client.send((fg.red + "Nickname cannot be empty!" + fg.rs).encode("utf-8"))
-                continue
+def cmd_quit(client: Client, rest: str):
+    """Makes the client leave the group."""
+    if client.is_owner:
+        client.send(_OWNER_CANNOT_QUIT)
+        return
+    nickname = client.nickname
+    client.send(_QUIT)
+    client._kill()
+    broadcast(_RED_B, nickname.encode("utf-8"), b" left the chat!", _RS)
 
-            if lowered == "/kick":
-                if not client.permissions.kick_members:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                client.send((fg.red + "Nickname cannot be empty!" + fg.rs).encode("utf-8"))
-                continue
 
-            if lowered == "/ban":
-                if not client.permissions.ban_members:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                client.send((fg.red + "Nickname cannot be empty!" + fg.rs).encode("utf-8"))
-                continue
+def cmd_delete(client: Client, rest: str):
+    """Deletes the group."""
+    global group
+    if not client.is_owner:
+        client.send(_PERM_DENIED)
+        return
+    broadcast(_DELETE)
+    group.delete()
+    group = None
+
+
+def cmd_nick(client: Client, rest: str):
+    """Changes the nickname of the client."""
+    if not (client._permissions & PermissionValues.CHANGE_NICKNAME):
+        client.send(_PERM_DENIED)
+        return
+    if not rest:
+        client.send(_EMPTY_NICKNAME)
+        return
+    old_nickname = client.nickname
+    new_nickname = rest
+    try:
+        client.set_nickname(new_nickname)
+    except Forbidden:
+        client.send(_NICKNAME_TAKEN)
+        return
+    broadcast(_BLUE_B, "{0} has now changed his nickname to {1}.".format(old_nickname, new_nickname).encode("utf-8"), _RS, exc=client)
+    client.send(_BLUE_B, b"You have changed your nickname to ", new_nickname.encode("utf-8"), b".", _RS)
+
+
+def cmd_kick(client: Client, rest: str):
+    """Kicks a member from the group."""
+    perms = client._permissions
+    if not (perms & PermissionValues.KICK_MEMBERS):
+        client.send(_PERM_DENIED)
+        return
+    if not rest:
+        client.send(_EMPTY_NICKNAME)
+        return
+    member = group.search_member(rest)
+    if member is None:
+        client.send(_MEMBER_NOT_FOUND)
+        return
+    if client == member:
+        client.send(_CANNOT_KICK_SELF)
+        return
+    if member.is_owner:
+        client.send(_CANNOT_KICK_OWNER)
+        return
+    if not is_subset(member._permissions, perms):
+        client.send(_CANNOT_KICK_HIGHER)
+        return
+
+    nickname = member.nickname
+    member.send(_KICK)
+    member.kick()
+    broadcast(_RED_B, "{0} was kicked by {1}.".format(nickname, client.nickname).encode("utf-8"), _RS)
+
+
+def cmd_ban(client: Client, rest: str):
+    """Bans a member from the group."""
+    perms = client._permissions
+    if not (perms & PermissionValues.BAN_MEMBERS):
+        client.send(_PERM_DENIED)
+        return
+    if not rest:
+        client.send(_EMPTY_NICKNAME)
+        return
+    member = group.search_member(rest)
+    if member is None:
+        client.send(_MEMBER_NOT_FOUND)
+        return
+    if client == member:
+        client.send(_CANNOT_BAN_SELF)
+        return
+    if member.is_owner:
+        client.send(_CANNOT_BAN_OWNER)
+        return
+    if not is_subset(member._permissions, perms):
+        client.send(_CANNOT_BAN_HIGHER)
+        return
+
+    nickname = member.nickname
+    member.send(_BAN)
+    member.ban()
+    broadcast(_RED_B, "{0} was banned by {1}.".format(nickname, client.nickname).encode("utf-8"), _RS)
+
+
+def cmd_setperms(client: Client, rest: str):
+    """Sets the permissions of a member."""
+    perms = client._permissions
+    if not (perms & PermissionValues.UPDATE_PERMISSIONS):
+        client.send(_PERM_DENIED)
+        return
+    if not rest:
+        client.send(_NUMBER_REQUIRED)
+        return
+    number, _, nickname = rest.partition(" ")
+    if not number:
+        client.send(_NO_NUMBER)
+        return
+    try:
+        number = int(number)
+        if number < 0 or number > PermissionValues.ALL:
+            raise ValueError
+    except ValueError:
+        client.send(_UNKNOWN_PERMISSION_VALUE)
+        return
+    if not is_subset(number, perms):
+        client.send(_CANNOT_GRANT_PERMISSIONS)
+        return
+    member = group.search_member(nickname)
+    if member is None:
+        client.send(_USER_NOT_FOUND)
+        return
+    if client == member:
+        client.send(_CANNOT_SETPERMS_SELF)
+        return
+    if member.is_owner:
+        client.send(_CANNOT_SETPERMS_OWNER)
+        return
+    if not is_subset(member._permissions, perms):
+        client.send(_CANNOT_SETPERMS_HIGHER)
+        return
+    member.set_permissions(number)
+    broadcast(_GREEN_B, "{0} now has permissions value {1}!".format(member.nickname, number).encode("utf-8"), _RS)
+
+
+def cmd_setowner(client: Client, rest: str):
+    """Transfers group ownership to a member."""
+    if not client.is_owner:
+        client.send(_PERM_DENIED)
+        return
+    if not rest:
+        client.send(_EMPTY_NICKNAME)
+        return
+    member = group.search_member(rest)
+    if member is None:
+        client.send(_MEMBER_NOT_FOUND)
+        return
+    if client == member:
+        client.send(_CANNOT_TRANSFER_SELF)
+        return
+    group.transfer_ownership(member)
+    broadcast(_BLUE_B, member.nickname.encode("utf-8"), b" is now the new group owner!", _RS, exc=member)
+    member.send(_NOW_OWNER)
+
+
+COMMANDS = {
+    b"/id":       cmd_id,
+    b"/info":     cmd_info,
+    b"/quit":     cmd_quit,
+    b"/delete":   cmd_delete,
+    b"/nick":     cmd_nick,
+    b"/kick":     cmd_kick,
+    b"/ban":      cmd_ban,
+    b"/setperms": cmd_setperms,
+    b"/setowner": cmd_setowner,
+}
+_COMMAND_RE = re.compile(b"(" + b"|".join(map(re.escape, COMMANDS)) + b")(?: (.*))?", re.IGNORECASE | re.DOTALL)
+
+
+def handle(socket, message):
+    """Handles a message sent by a client member."""
+    client: Client = group.get_client(socket)
+    message = message.strip()
+    if not message:
+        return
+
+    match = _COMMAND_RE.fullmatch(message)
+    if match is not None:
+        verb, rest = match.groups()
+        COMMANDS[verb.lower()](client, rest.decode("utf-8") if rest is not None else "")
+        return
+    if message.startswith(b"/") and message != b"/":
+        client.send(_UNKNOWN_COMMAND)
+        return
+
+    if client._permissions & PermissionValues.SEND_MESSAGES:
+        message.decode("utf-8")  # Rejects invalid UTF-8 before it reaches other clients.
+        broadcast(_BLUE_B, client.nickname.encode("utf-8"), _RS, b": ", message, exc=client)
+        # client.send((fg.green + "Message sent!" + fg.rs).encode("utf-8"))
+        return
+    client.send(_CANNOT_SEND)
+
+
+def disconnect(socket):
+    """Closes a connection, removing its client from the group. Does nothing if it is already closed."""
+    global group
+    if get_key(socket) is None:
+        return
+    selector.unregister(socket)
+    pending.discard(socket)
+    overflowed.discard(socket)
+    try:
+        if group is None:
+            return
+        client: Client = group.get_client(socket)
+        if client is None:
+            return
+        nickname = client.nickname
+        if client.is_owner:
+            broadcast(_DELETE, exc=client)
+            group.delete()
+            group = None
+            return
+        client._kill()
+        broadcast(_RED_B, nickname.encode("utf-8"), b" left the chat!", _RS)
+    finally:
+        socket.close()
 
-            if lowered == "/setperms":
-                if not client.permissions.update_permissions:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                client.send((fg.red + "Number must be provided!" + fg.rs).encode("utf-8"))
-                continue
 
-            if lowered == "/setowner":
-                if not client.is_owner:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                client.send((fg.red + "Nickname cannot be empty!" + fg.rs).encode("utf-8"))
-                continue
-            
-            if lowered.startswith("/nick "):
-                if not client.permissions.change_nickname:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                old_nickname = client.nickname
-                new_nickname = decoded[6:]
-                if not new_nickname:
-                    client.send((fg.red + "Nickname cannot be empty!" + fg.rs).encode("utf-8"))
-                    continue
-
-                try:
-                    client.set_nickname(new_nickname)
-                except Forbidden:
-                    client.send((fg.red + "Nickname is already taken by someone else!" + fg.rs).encode("utf-8"))
-                    continue
-                broadcast((fg.blue + ef.bold + "{0} has now changed his nickname to {1}.".format(old_nickname, new_nickname) + ef.rs + fg.rs).encode("utf-8"), client)
-                client.send((fg.blue + ef.bold + "You have changed your nickname to {0}.".format(new_nickname) + ef.rs + fg.rs).encode("utf-8"))
-                continue
+def join(socket, nickname: str):
+    """Adds a pending connection to the group once it has sent its nickname."""
+    global group
+    if not nickname.strip():
+        send_message(socket, _EMPTY_NICKNAME_RETRY)
+        return
+    if group is None:
+        group = Group("Default", User(nickname, socket))
+        curr_client = group.owner
+    else:
+        if group.search_member(nickname) is not None:
+            send_message(socket, _NICKNAME_CHOSEN)
+            return
+        try:
+            curr_client = group.add(User(nickname, socket))
+        except Forbidden:
+            pending.discard(socket)
+            send_message(socket, _BANNED)
+            return
 
-            if lowered.startswith("/kick "):
-                if not client.permissions.kick_members:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                index, member = group.search_member(decoded[6:])
-                if member is None:
-                    client.send((fg.red + "Member not found!" + fg.rs).encode("utf-8"))
-                    continue
-                if client == member:
-                    client.send((fg.red + "You cannot kick yourself! Please use /quit to quit the group." + fg.rs).encode("utf-8"))
-                    continue
-                if member.is_owner:
-                    client.send((fg.red + "Cannot kick user as they own the group!" + fg.rs).encode("utf-8"))
-                    continue
-                if not (member.permissions <= client.permissions):
-                    client.send((fg.red + "Cannot kick user as they have permissions you do not have!" + fg.rs).encode("utf-8"))
-                    continue
-
-                nickname = member.nickname
-                member.send("/kick".encode("utf-8"))
-                member.kick()
-                broadcast((fg.red + ef.bold + "{0} was kicked by {1}.".format(nickname, client.nickname) + ef.rs + fg.rs).encode("utf-8"))
-                continue
+    pending.discard(socket)
+    print("Nickname of the client is {0}".format(nickname))
+    broadcast(_YELLOW_B, nickname.encode("utf-8"), b" joined the chat!", _RS, exc=curr_client)
+    send_message(socket, _CONNECTED)
 
-            if lowered.startswith("/ban "):
-                if not client.permissions.ban_members:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                index, member = group.search_member(decoded[5:])
-                if member is None:
-                    client.send((fg.red + "Member not found!" + fg.rs).encode("utf-8"))
-                    continue
-                if client == member:
-                    client.send((fg.red + "You cannot ban yourself!" + fg.rs).encode("utf-8"))
-                    continue
-                if member.is_owner:
-                    client.send((fg.red + "Cannot ban user as they own the group!" + fg.rs).encode("utf-8"))
-                    continue
-                if not (member.permissions <= client.permissions):
-                    client.send((fg.red + "Cannot ban user as they have permissions you do not have!" + fg.rs).encode("utf-8"))
-                    continue
-
-                nickname = member.nickname
-                member.send("/ban".encode("utf-8"))
-                member.ban()
-                broadcast((fg.red + ef.bold + "{0} was banned by {1}.".format(nickname, client.nickname) + ef.rs + fg.rs).encode("utf-8"))
-                continue
 
-            if lowered.startswith("/setperms "):
-                if not client.permissions.update_permissions:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                try:
-                    number = decoded[10:].split()[0]
-                except IndexError:
-                    client.send((fg.red + "No number specified!" + fg.rs).encode("utf-8"))
-                    continue
-                try:
-                    number = int(number)
-                    if number < 0 or number > PermissionValues.ALL:
-                        raise ValueError
-                except ValueError:
-                    client.send((fg.red + "Permission value not recognised!" + fg.rs).encode("utf-8"))
-                    continue
-                if not (client.permissions >= Permissions(number)):
-                    client.send((fg.red + "Cannot change permissions you do not have!" + fg.rs).encode("utf-8"))
-                    continue
-                index, member = group.search_member(decoded[(11+len(str(number))):])
-                if member is None:
-                    client.send((fg.red + "User not found!" + fg.rs).encode("utf-8"))
-                    continue
-                if client == member:
-                    client.send((fg.red + "You cannot change yourself permissions!" + fg.rs).encode("utf-8"))
-                    continue
-                if member.is_owner:
-                    client.send((fg.red + "Owner cannot be changed permissions!" + fg.rs).encode("utf-8"))
-                    continue
-                if not (member.permissions <= client.permissions):
-                    client.send((fg.red + "Cannot set these permissions for member as they have permissions you do not have!" + fg.rs).encode("utf-8"))
-                    continue
-                member.set_permissions(number)
-                broadcast((fg.green + ef.bold + "{0} now has permissions value {1}!".format(member.nickname, number) + ef.rs + fg.rs).encode("utf-8"))
-                continue
+def tune_socket(sock):
+    """Disables Nagle's algorithm on a connected socket."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-            if lowered.startswith("/setowner "):
-                if not client.is_owner:
-                    client.send((fg.red + "Permission denied!" + fg.rs).encode("utf-8"))
-                    continue
-                index, member = group.search_member(decoded[10:])
-                if member is None:
-                    client.send((fg.red + "Member not found!" + fg.rs).encode("utf-8"))
-                    continue
-                if client == member:
-                    client.send((fg.red + "Cannot transfer ownership to yourself!" + fg.rs).encode("utf-8"))
-                    continue
-                group.transfer_ownership(member)
-                broadcast((fg.blue + ef.bold + "{0} is now the new group owner!".format(member.nickname) + ef.rs + fg.rs).encode("utf-8"), member)
-                member.send((fg.blue + ef.bold + "You are now the group owner!" + ef.rs + fg.rs).encode("utf-8"))
-                continue
 
-            if lowered.startswith("/") and lowered != "/":
-                client.send((fg.red + "Unknown command!" + fg.rs).encode("utf-8"))
-                continue
-            
-            if client.permissions.send_messages:
-                broadcast((fg.blue + ef.bold + client.nickname + ef.rs + fg.rs + ": " + message.decode("utf-8")).encode("utf-8"), client)
-                # client.send((fg.green + "Message sent!" + fg.rs).encode("utf-8"))
-                continue
-            client.send((fg.red + "No permission to send messages!" + fg.rs).encode("utf-8"))
-        except:
-            try:
-                nickname = client.nickname
-                if client.is_owner:
-                    broadcast("/delete".encode("utf-8"))
-                    group.delete()
-                    group = None
-                    break
-                client._kill()
-                client.socket.close()
-                broadcast((fg.red + ef.bold + "{0} left the chat!".format(nickname) + ef.rs + fg.rs).encode("utf-8"))
-            finally:
+def accept():
+    """Accepts a new connection and asks for its nickname."""
+    client, address = server.accept()
+    print("Connected with {0}".format(str(address)))
+    tune_socket(client)
+    client.setblocking(False)
+    selector.register(client, selectors.EVENT_READ, ConnBuffer())
+    pending.add(client)
+    send_message(client, _NICK)
+
+
+def read(socket, buffer: ConnBuffer):
+    """Reads a connection and processes every complete message it has sent."""
+    try:
+        if not buffer.fill(socket):
+            raise OperationFailed("connection closed.") from None
+        while True:
+            message = buffer.pop()
+            if message is None:
                 break
+            if socket in pending:
+                join(socket, message.decode("utf-8"))
+            elif group is not None and group.get_client(socket) is not None:
+                handle(socket, message)
+    except BlockingIOError:
+        return
+    except Exception:
+        disconnect(socket)
+
+
+def write(socket, buffer: ConnBuffer):
+    """Writes queued messages to a connection, and stops watching for writability once the queue is empty."""
+    try:
+        buffer.flush(socket)
+    except BlockingIOError:
+        return
+    except OSError:
+        disconnect(socket)
+        return
+    if not buffer.outq:
+        selector.modify(socket, selectors.EVENT_READ, buffer)
 
 
 def receive():
     """Main loop."""
-    global group
+    selector.register(server, selectors.EVENT_READ)
     while True:
-        client, address = server.accept()
-        print("Connected with {0}".format(str(address)))
-
-        client.send("/nick".encode("utf-8"))
-        if group is None:
-            nickname = client.recv(1024).decode("utf-8")
-            group = Group("Default", User(nickname, client))
-            curr_client = group.owner
-        else:
-            while True:
-                nickname = client.recv(1024).decode("utf-8")
-                if not nickname.strip():
-                    client.send((fg.red + "Nickname cannot be empty! Please retry!" + fg.rs).encode("utf-8"))
-                    continue
-                index, search = group.search_member(nickname)
-                if search is None:
-                    break
-                client.send((fg.red + "Nickname already chosen! Please choose a different nickname!" + fg.rs).encode("utf-8"))
-            try:
-                curr_client = group.add(User(nickname, client))
-            except Forbidden:
-                client.send((fg.red + ef.bold + "You have been banned from this group and cannot rejoin it!" + ef.rs + fg.rs).encode("utf-8"))
+        for key, mask in selector.select():
+            if key.fileobj is server:
+                accept()
                 continue
-
-        print("Nickname of the client is {0}".format(nickname))
-        broadcast((fg.yellow + ef.bold + "{0} joined the chat!".format(nickname) + ef.rs + fg.rs).encode("utf-8"), curr_client)
-        client.send((fg.green + ef.bold + "Connected to the server!" + ef.rs + fg.rs).encode("utf-8"))
-
-        thread = threading.Thread(target=handle, args=(client,))
-        thread.start()
+            if mask & selectors.EVENT_WRITE and get_key(key.fileobj) is not None:
+                write(key.fileobj, key.data)
+            if mask & selectors.EVENT_READ and get_key(key.fileobj) is not None:
+                read(key.fileobj, key.data)
+            while overflowed:
+                disconnect(next(iter(overflowed)))
 
 
 print("Server is listening on port {0}".format(port))